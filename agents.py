@@ -1,44 +1,166 @@
+import hashlib
+import json
 import os
-from dotenv import load_dotenv
-
-load_dotenv()
+import threading
+import time
+from cachetools import TTLCache
 
 # Fix: Use CrewAI's LLM configuration for Google Gemini
 from crewai import LLM
 
-# Configure LLM for CrewAI with proper provider format
-llm = LLM(
-    model="gemini/gemini-2.5-flash",  # Specify provider/model format
-    api_key=os.getenv("GOOGLE_API_KEY")
-)
+# Rich-formatted step logs cost real time per kickoff under load; enable
+# them only when explicitly debugging
+CREW_VERBOSE = os.getenv("CREW_DEBUG") == "1"
+
+
+class _TokenBucket:
+    """Thread-safe token bucket shared by every agent's LLM calls
+
+    CrewAI runs LLM calls on worker threads, so the bucket blocks the
+    calling thread (not the event loop) until a token is available.
+    """
+
+    def __init__(self, rate_per_minute: int):
+        self.capacity = float(rate_per_minute)
+        self.tokens = float(rate_per_minute)
+        self.fill_rate = rate_per_minute / 60.0
+        self.timestamp = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.timestamp) * self.fill_rate)
+                self.timestamp = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.fill_rate
+            time.sleep(wait)
+
+
+# One bucket sized to the Gemini project quota and shared across all four
+# agents, so one slow agent cannot starve the others the way independent
+# per-agent max_rpm throttles did
+GEMINI_RPM = int(os.getenv("GEMINI_RPM", "1000"))
+_global_limiter = _TokenBucket(GEMINI_RPM)
+
+
+def _cache_key(model, messages, tools):
+    payload = json.dumps(
+        {"model": model, "messages": messages, "tools": tools},
+        sort_keys=True,
+        default=str
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _instrument_llm(llm_instance):
+    """Wrap an LLM instance's call with rate limiting and a completion cache
+
+    Subclassing LLM does not work here: LLM.__new__ dispatches gemini/*
+    models to a provider-native completion class and discards the subclass,
+    so an overridden call() is never invoked. Wrapping call on the instance
+    keeps whatever concrete class CrewAI picks.
+
+    The task prompts are static templates, so re-running an identical report
+    and query re-pays the full Gemini bill for the same answer. Completions
+    are cached in-process keyed on (model, messages, tools) with a TTL;
+    sampling at temperature > 0 is non-deterministic and is never cached.
+    Every call, cached or not, is throttled through the shared token bucket.
+    """
+    cache = TTLCache(maxsize=1024, ttl=3600)
+    stats = {"hits": 0, "misses": 0}
+    inner_call = llm_instance.call
+
+    def call(messages, tools=None, *args, **kwargs):
+        temperature = getattr(llm_instance, "temperature", None)
+        if temperature and temperature > 0:
+            _global_limiter.acquire()
+            return inner_call(messages, tools=tools, *args, **kwargs)
+
+        key = _cache_key(llm_instance.model, messages, tools)
+        if key in cache:
+            stats["hits"] += 1
+            return cache[key]
+
+        stats["misses"] += 1
+        _global_limiter.acquire()
+        result = inner_call(messages, tools=tools, *args, **kwargs)
+        if isinstance(result, str):
+            cache[key] = result
+        return result
+
+    llm_instance.call = call
+    llm_instance.stats = stats
+    return llm_instance
+
+
+def build_llm(api_key: str = None) -> LLM:
+    """Build the shared Gemini LLM with the proper provider/model format
+
+    The environment is loaded once by the entrypoint (main.py) before this
+    module is imported; callers may also pass a resolved key explicitly.
+    """
+    return _instrument_llm(LLM(
+        model="gemini/gemini-2.5-flash",  # Specify provider/model format
+        api_key=api_key or os.getenv("GOOGLE_API_KEY")
+    ))
+
+
+llm = build_llm()
 
 from crewai import Agent
 
 # Fix 6: Import tools correctly
-from tools import search_tool, blood_test_tool, nutrition_tool, exercise_tool
+from tools import search_tool, blood_test_tool, raw_blood_test_tool, nutrition_tool, exercise_tool
 
-doctor = Agent(
-    role="Senior Medical Doctor",
-    goal="Analyze blood test reports professionally and provide accurate, evidence-based medical insights for: {query}",
-    verbose=True,
-    memory=True,
-    backstory=(
-        "You are a board-certified physician with 20 years of experience in laboratory medicine and diagnostics. "
-        "You specialize in interpreting blood test results with precision and providing clear, actionable medical advice. "
-        "You always prioritize patient safety and base recommendations on current medical evidence and guidelines. "
-        "You explain complex medical concepts in terms patients can understand while maintaining clinical accuracy."
+# Interpretation styles for parallel-plan mode: the same doctor profile
+# biased toward different readings of an ambiguous query
+DOCTOR_STYLES = {
+    "standard": (
+        "You balance sensitivity and specificity the way a typical clinical reviewer would."
     ),
-    tools=[blood_test_tool, search_tool],
-    llm=llm,
-    max_iter=3,
-    max_rpm=10,
-    allow_delegation=True
+    "conservative": (
+        "You favor cautious, guideline-first interpretations and explicitly flag any uncertainty "
+        "rather than speculating beyond what the values support."
+    ),
+    "aggressive": (
+        "You actively surface borderline values and less common but clinically relevant "
+        "explanations that are worth ruling out with a healthcare provider."
+    ),
+}
+
+_DOCTOR_BACKSTORY = (
+    "You are a board-certified physician with 20 years of experience in laboratory medicine and diagnostics. "
+    "You specialize in interpreting blood test results with precision and providing clear, actionable medical advice. "
+    "You always prioritize patient safety and base recommendations on current medical evidence and guidelines. "
+    "You explain complex medical concepts in terms patients can understand while maintaining clinical accuracy."
 )
 
+
+def build_doctor(style: str = "standard") -> Agent:
+    """Build a doctor agent biased toward one interpretation style"""
+    return Agent(
+        role="Senior Medical Doctor",
+        goal="Analyze blood test reports professionally and provide accurate, evidence-based medical insights for: {query}",
+        verbose=CREW_VERBOSE,
+        memory=True,
+        backstory=f"{_DOCTOR_BACKSTORY} {DOCTOR_STYLES[style]}",
+        tools=[blood_test_tool, search_tool],
+        llm=llm,
+        max_iter=3,
+        allow_delegation=True
+    )
+
+
+doctor = build_doctor()
+
 verifier = Agent(
     role="Medical Report Validator",
     goal="Verify the authenticity and completeness of blood test reports before medical analysis.",
-    verbose=True,
+    verbose=CREW_VERBOSE,
     memory=True,
     backstory=(
         "You are a certified medical records specialist with expertise in validating laboratory reports. "
@@ -46,17 +168,16 @@ verifier = Agent(
         "required medical information, and appropriate laboratory standards. You flag any inconsistencies "
         "or missing critical information that could affect medical interpretation."
     ),
-    tools=[blood_test_tool],
+    tools=[raw_blood_test_tool],
     llm=llm,
     max_iter=2,
-    max_rpm=10,
     allow_delegation=False
 )
 
 nutritionist = Agent(
     role="Registered Dietitian",
     goal="Provide evidence-based nutritional recommendations based on blood test analysis for: {query}",
-    verbose=True,
+    verbose=CREW_VERBOSE,
     memory=True,
     backstory=(
         "You are a registered dietitian nutritionist with 15 years of clinical experience. "
@@ -67,14 +188,13 @@ nutritionist = Agent(
     tools=[blood_test_tool, nutrition_tool, search_tool],
     llm=llm,
     max_iter=3,
-    max_rpm=10,
     allow_delegation=False
 )
 
 exercise_specialist = Agent(
     role="Clinical Exercise Physiologist",
     goal="Design safe, effective exercise recommendations based on blood test results for: {query}",
-    verbose=True,
+    verbose=CREW_VERBOSE,
     memory=True,
     backstory=(
         "You are a certified clinical exercise physiologist with expertise in exercise prescription "
@@ -85,6 +205,5 @@ exercise_specialist = Agent(
     tools=[blood_test_tool, exercise_tool, search_tool],
     llm=llm,
     max_iter=3,
-    max_rpm=10,
     allow_delegation=False
 )
@@ -0,0 +1,111 @@
+import json
+import os
+import re
+import tempfile
+import uuid
+
+# Gemini batch mode is billed at 50% of the interactive per-token price and
+# is not subject to the interactive RPM caps, in exchange for results
+# arriving asynchronously within a 24h window
+BATCH_MODEL = "gemini-2.5-flash"
+
+ANALYSIS_PROMPT = (
+    "You are a board-certified physician with 20 years of experience in laboratory "
+    "medicine and diagnostics. Analyze the blood test report below and address the "
+    "user's query with clear, evidence-based medical insights. Explain any abnormal "
+    "values and their clinical significance, and emphasize that this analysis is for "
+    "educational purposes and not a substitute for professional medical advice.\n\n"
+    "Blood test report:\n{report}\n\n"
+    "Query: {query}"
+)
+
+# Job handles are the final segment of the provider's batch job name
+# (batches/<id>), so any uvicorn worker can resolve a handle it did not
+# submit itself without shared state
+_JOB_ID_PATTERN = re.compile(r"[A-Za-z0-9_-]+")
+
+
+def _get_client():
+    """Build a Gemini client lazily so the SDK is only required for batch mode"""
+    from google import genai
+    return genai.Client(api_key=os.getenv("GOOGLE_API_KEY"))
+
+
+def submit_batch_job(report_text: str, queries: list) -> str:
+    """Submit one batch request per query and return the job handle
+
+    Args:
+        report_text (str): Extracted text of the blood test report.
+        queries (list): User queries to analyze against the report.
+
+    Returns:
+        str: Job id to poll via get_batch_job.
+    """
+    client = _get_client()
+    submission_id = str(uuid.uuid4())
+
+    # Accumulate requests into a JSONL file in the batch API's input format
+    with tempfile.NamedTemporaryFile("w", suffix=".jsonl", delete=False) as f:
+        for i, query in enumerate(queries):
+            f.write(json.dumps({
+                "key": f"{submission_id}-{i}",
+                "request": {
+                    "contents": [{
+                        "parts": [{"text": ANALYSIS_PROMPT.format(report=report_text, query=query)}]
+                    }]
+                }
+            }) + "\n")
+        jsonl_path = f.name
+
+    try:
+        src = client.files.upload(
+            file=jsonl_path,
+            config={"mime_type": "application/jsonl"}
+        )
+        batch_job = client.batches.create(
+            model=BATCH_MODEL,
+            src=src.name,
+            config={"display_name": f"blood-report-batch-{submission_id}"}
+        )
+        # The provider name is "batches/<id>"; the last segment alone is
+        # enough to reconstruct it when polling
+        return batch_job.name.split("/")[-1]
+    finally:
+        os.remove(jsonl_path)
+
+
+def get_batch_job(job_id: str):
+    """Poll a submitted batch job and fetch its results once finished
+
+    Args:
+        job_id (str): Handle returned by submit_batch_job.
+
+    Returns:
+        dict: Job state plus per-query results when the job has succeeded,
+        or None if the job id is malformed.
+    """
+    if not _JOB_ID_PATTERN.fullmatch(job_id or ""):
+        return None
+
+    client = _get_client()
+    batch_job = client.batches.get(name=f"batches/{job_id}")
+    state = batch_job.state.name
+
+    status = {"job_id": job_id, "state": state}
+
+    if state == "JOB_STATE_SUCCEEDED":
+        content = client.files.download(file=batch_job.dest.file_name)
+        results = []
+        for line in content.decode("utf-8").splitlines():
+            entry = json.loads(line)
+            response = entry.get("response", {})
+            try:
+                text = response["candidates"][0]["content"]["parts"][0]["text"]
+            except (KeyError, IndexError):
+                text = f"Error in batch response: {entry.get('error', 'no candidates returned')}"
+            results.append({"key": entry.get("key"), "analysis": text})
+        status["results"] = results
+    elif state == "JOB_STATE_FAILED":
+        status["error"] = str(batch_job.error)
+
+    return status
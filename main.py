@@ -1,46 +1,297 @@
 from fastapi import FastAPI, File, UploadFile, Form, HTTPException
+from fastapi.responses import ORJSONResponse
+from typing import List
+import concurrent.futures
+import json
+import logging
 import os
 import uuid
 import asyncio
 
+from dotenv import load_dotenv
+
+# Load .env exactly once per process, before the agent/tool modules read
+# their API keys at import; they no longer call load_dotenv themselves
+load_dotenv()
+
 from crewai import Crew, Process
 # Fix 8: Import all necessary agents and tasks
-from agents import doctor, nutritionist, exercise_specialist, verifier
-from task import help_patients, nutrition_analysis, exercise_planning, verification
+from agents import doctor, nutritionist, exercise_specialist, verifier, llm, build_doctor, DOCTOR_STYLES, CREW_VERBOSE
+from task import help_patients, verification, build_help_patients_task, build_nutrition_task, build_exercise_task
+from tools import extract_pdf_text, register_report, register_report_text, get_report_text, unregister_report, looks_like_blood_report
+import batch
+
+# Production logs go through logging at INFO instead of CrewAI's
+# Rich-formatted stdout dumps, which are gated behind CREW_DEBUG=1
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger("blood_test_analyzer")
+
+# orjson serializes the multi-kB analysis payloads several times faster
+# than the stdlib encoder, freeing event-loop time between requests
+app = FastAPI(title="Professional Blood Test Report Analyzer", default_response_class=ORJSONResponse)
+
+# Upload limits: enforce the cap while streaming instead of trusting file.size
+MAX_UPLOAD_SIZE = 10 * 1024 * 1024  # 10MB
+UPLOAD_CHUNK_SIZE = 64 * 1024  # 64KB working set per request
+
+# Opt-in process pool (CREW_PROCESS_POOL=1) so N cores can run N user
+# sessions truly in parallel when the Python-side work inside a kickoff
+# (prompt assembly, tool retries, pydantic validation) is GIL-bound.
+_process_pool = None
+
+
+def _get_process_pool():
+    global _process_pool
+    if _process_pool is None:
+        _process_pool = concurrent.futures.ProcessPoolExecutor(max_workers=os.cpu_count())
+    return _process_pool
+
+
+def _kickoff_sync(query: str, file_path: str, analysis_type: str, report_text: str = None) -> str:
+    """Run one full crew kickoff synchronously inside a worker process
+
+    Agents, tasks and the LLM are rebuilt per worker via import (they do
+    not pickle), so nothing is shared with the parent process. The parent
+    passes the extracted report text along since its in-memory report
+    store is not visible from the worker.
+    """
+    from crewai import Crew, Process
+    from agents import doctor, nutritionist, exercise_specialist
+    from task import help_patients, nutrition_analysis, exercise_planning
+    from tools import register_report_text as register_in_worker
+
+    if report_text is not None:
+        register_in_worker(file_path, report_text)
+
+    if analysis_type == "comprehensive":
+        crew = Crew(
+            agents=[doctor, nutritionist, exercise_specialist],
+            tasks=[help_patients, nutrition_analysis, exercise_planning],
+            process=Process.sequential,
+            verbose=CREW_VERBOSE
+        )
+    else:
+        crew = Crew(
+            agents=[doctor],
+            tasks=[help_patients],
+            process=Process.sequential,
+            verbose=CREW_VERBOSE
+        )
+    return str(crew.kickoff({'query': query, 'file_path': file_path}))
+
+
+# Prototype crews built once at import; CrewAI's internal prompt/template
+# compilation happens once per process. Crews are not safe for concurrent
+# kickoffs on one instance (task outputs are mutable state), so run_crew
+# takes a cheap copy() per request and kicks that off instead.
+# Single-task sub-crews let run_crew schedule the comprehensive path as a DAG.
+VERIFIER_CREW = Crew(
+    agents=[verifier],
+    tasks=[verification],
+    process=Process.sequential,
+    verbose=CREW_VERBOSE
+)
+DOCTOR_CREW = Crew(
+    agents=[doctor],
+    tasks=[help_patients],
+    process=Process.sequential,
+    verbose=CREW_VERBOSE
+)
+MEDICAL_ONLY_CREW = Crew(
+    agents=[doctor],
+    tasks=[help_patients],
+    process=Process.sequential,
+    verbose=CREW_VERBOSE
+)
+BULK_CREW = Crew(
+    agents=[doctor],
+    tasks=[help_patients],
+    process=Process.sequential,
+    verbose=CREW_VERBOSE
+)
+
+
+def _build_style_crew(style: str) -> Crew:
+    agent = build_doctor(style)
+    return Crew(
+        agents=[agent],
+        tasks=[build_help_patients_task(agent)],
+        process=Process.sequential,
+        verbose=CREW_VERBOSE
+    )
+
+
+# Parallel-plan mode: one doctor crew per interpretation style, raced for
+# the first answer when a request opts in with mode=parallel
+PARALLEL_CREWS = {style: _build_style_crew(style) for style in DOCTOR_STYLES}
+
+
+async def run_parallel_plans(context: dict) -> str:
+    """Race one doctor crew per interpretation style, keep the first success
+
+    Trades extra Gemini cost for lower tail latency and success rate: the
+    first style to finish without an error wins, and a style that fails
+    fast never pre-empts one that is about to succeed. Losing tasks are
+    cancelled on the asyncio side, though a cancel cannot interrupt a
+    kickoff already running on its worker thread, so in-flight Gemini
+    spend is not necessarily recovered.
+    """
+    tasks = [
+        asyncio.create_task(crew.copy().kickoff_async(context))
+        for crew in PARALLEL_CREWS.values()
+    ]
+
+    errors = []
+    try:
+        for finished in asyncio.as_completed(tasks):
+            try:
+                return str(await finished)
+            except Exception as e:
+                errors.append(e)
+    finally:
+        for task in tasks:
+            task.cancel()
+    raise errors[0]
+
 
-app = FastAPI(title="Professional Blood Test Report Analyzer")
+async def read_upload(file: UploadFile) -> bytes:
+    """Read an uploaded file into memory, enforcing the size cap incrementally
+
+    Uploads stay in memory for their whole lifetime; nothing is written to
+    disk, so there is no temp file to create, fsync or clean up.
+    """
+    buffer = bytearray()
+    while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+        buffer.extend(chunk)
+        if len(buffer) > MAX_UPLOAD_SIZE:
+            raise HTTPException(status_code=413, detail="File size too large. Maximum 10MB allowed")
+
+    if not buffer:
+        raise HTTPException(status_code=400, detail="Empty file uploaded")
+    return bytes(buffer)
+
+
+async def load_blood_report(file: UploadFile, file_path: str = None) -> str:
+    """Read, gate and parse an uploaded report before any LLM is invoked
+
+    The deterministic checks run in safe order: the %PDF- magic bytes are
+    verified before parsing is attempted, parse failures map to 422 rather
+    than surfacing as a 500, and the marker scan rejects documents that
+    are not blood test reports. When a file_path key is given the
+    extracted text is also registered in the in-memory report store.
+    """
+    pdf_bytes = await read_upload(file)
+    if pdf_bytes[:5] != b"%PDF-":
+        raise HTTPException(status_code=422, detail="Uploaded file is not a valid PDF")
 
-def run_crew(query: str, file_path: str = "data/sample.pdf", analysis_type: str = "comprehensive"):
-    """Run the medical analysis crew"""
     try:
-        # Fix 9: Create different crew configurations based on analysis type
+        if file_path is not None:
+            report_text = register_report(file_path, pdf_bytes)
+        else:
+            report_text = extract_pdf_text(pdf_bytes)
+    except Exception as e:
+        raise HTTPException(status_code=422, detail=f"Uploaded file could not be parsed as a PDF: {str(e)}")
+
+    if not looks_like_blood_report(report_text):
+        raise HTTPException(status_code=422, detail="Document does not appear to contain blood test results")
+    return report_text
+
+
+# Explicit verdict tokens the verification task is instructed to lead
+# with. Scanning for loose words like "invalid" would false-positive on
+# routine narrative such as "no invalid values were found".
+_VERDICT_INVALID = "verdict: invalid"
+_VERDICT_VALID = "verdict: valid"
+
+
+def _verification_failed(verification_text: str) -> bool:
+    """Interpret the verifier's output, failing closed on a missing verdict
+
+    A verifier that wandered off-format and produced neither verdict has
+    not validated the document, so that counts as a failure rather than a
+    pass.
+    """
+    text = verification_text.casefold()
+    if _VERDICT_INVALID in text:
+        return True
+    if _VERDICT_VALID not in text:
+        logger.warning("Verifier output missing explicit verdict; treating document as unverified")
+        return True
+    return False
+
+
+async def run_crew(query: str, file_path: str = "data/sample.pdf", analysis_type: str = "comprehensive", mode: str = "single"):
+    """Run the medical analysis crew as a DAG of concurrent sub-crews"""
+    try:
+        # When enabled, hand the whole kickoff to a worker process so
+        # concurrent sessions are not serialized by the GIL
+        if os.getenv("CREW_PROCESS_POOL") == "1":
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(
+                _get_process_pool(), _kickoff_sync, query, file_path,
+                analysis_type, get_report_text(file_path)
+            )
+
+        context = {'query': query, 'file_path': file_path}
+
+        if mode == "parallel":
+            return await run_parallel_plans(context)
+
         if analysis_type == "comprehensive":
-            medical_crew = Crew(
-                agents=[verifier, doctor, nutritionist, exercise_specialist],
-                tasks=[verification, help_patients, nutrition_analysis, exercise_planning],
+            # Per-request copies of the phase-1 prototypes, so one patient's
+            # analysis can never leak into another's
+            verifier_crew = VERIFIER_CREW.copy()
+            doctor_crew = DOCTOR_CREW.copy()
+
+            # Phase-2 crews are built fresh per request because their tasks'
+            # context must point at this request's copy of the doctor's task;
+            # Crew.copy() cannot resolve a context reference into another crew
+            nutrition_crew = Crew(
+                agents=[nutritionist],
+                tasks=[build_nutrition_task(context=[doctor_crew.tasks[0]])],
                 process=Process.sequential,
-                verbose=True
+                verbose=CREW_VERBOSE
             )
-        elif analysis_type == "medical_only":
-            medical_crew = Crew(
-                agents=[doctor],
-                tasks=[help_patients],
+            exercise_crew = Crew(
+                agents=[exercise_specialist],
+                tasks=[build_exercise_task(context=[doctor_crew.tasks[0]])],
                 process=Process.sequential,
-                verbose=True
+                verbose=CREW_VERBOSE
             )
-        else:
-            medical_crew = Crew(
-                agents=[doctor],
-                tasks=[help_patients],
-                process=Process.sequential,
-                verbose=True
+
+            # Phase 1, speculative: the doctor's expensive analysis starts
+            # immediately while the LLM verifier double-checks the document
+            # in parallel. The deterministic gate already rejected obvious
+            # junk, so discarding the speculative analysis is the rare case.
+            doctor_task = asyncio.create_task(doctor_crew.kickoff_async(context))
+            verifier_task = asyncio.create_task(verifier_crew.kickoff_async(context))
+
+            verification_result = await verifier_task
+            if _verification_failed(str(verification_result)):
+                doctor_task.cancel()
+                logger.info("Speculative analysis cancelled: document failed verification")
+                raise HTTPException(status_code=422, detail=f"Document failed verification: {verification_result}")
+
+            medical_result = await doctor_task
+
+            # Phase 2: nutrition and exercise only depend on the doctor's
+            # output (wired via Task.context), not on each other
+            nutrition_result, exercise_result = await asyncio.gather(
+                nutrition_crew.kickoff_async(context),
+                exercise_crew.kickoff_async(context)
             )
-        
-        # Update task context with file path
-        context = {'query': query, 'file_path': file_path}
-        result = medical_crew.kickoff(context)
-        return result
-        
+
+            return (
+                f"DOCUMENT VERIFICATION:\n{verification_result}\n\n"
+                f"MEDICAL ANALYSIS:\n{medical_result}\n\n"
+                f"NUTRITION RECOMMENDATIONS:\n{nutrition_result}\n\n"
+                f"EXERCISE PLAN:\n{exercise_result}"
+            )
+        else:
+            return await MEDICAL_ONLY_CREW.copy().kickoff_async(context)
+
+    except HTTPException:
+        raise
     except Exception as e:
         raise Exception(f"Error running medical analysis: {str(e)}")
 
@@ -57,41 +308,35 @@ async def root():
 async def analyze_blood_report(
     file: UploadFile = File(...),
     query: str = Form(default="Provide a comprehensive analysis of my blood test report"),
-    analysis_type: str = Form(default="comprehensive")
+    analysis_type: str = Form(default="comprehensive"),
+    mode: str = Form(default="single")
 ):
     """Analyze blood test report and provide professional health recommendations"""
     
     # Fix 10: Add proper file validation
     if not file.filename.lower().endswith('.pdf'):
         raise HTTPException(status_code=400, detail="Only PDF files are supported")
-    
-    if file.size > 10 * 1024 * 1024:  # 10MB limit
-        raise HTTPException(status_code=400, detail="File size too large. Maximum 10MB allowed")
-    
-    # Generate unique filename to avoid conflicts
-    file_id = str(uuid.uuid4())
-    file_path = f"data/blood_test_report_{file_id}.pdf"
-    
+
+    # Synthetic path keying the in-memory report store; nothing is written
+    # to disk, so there is no filename conflict or cleanup race to manage
+    file_path = f"report://{uuid.uuid4()}"
+
     try:
-        # Ensure data directory exists
-        os.makedirs("data", exist_ok=True)
-        
-        # Save uploaded file
-        with open(file_path, "wb") as f:
-            content = await file.read()
-            if not content:
-                raise HTTPException(status_code=400, detail="Empty file uploaded")
-            f.write(content)
-        
+        # Parse the upload once, straight from memory, and reject documents
+        # that are not blood test reports before any LLM call
+        await load_blood_report(file, file_path)
+        logger.info("Analyzing %s (%s, mode=%s)", file.filename, analysis_type, mode)
+
         # Validate query
         if not query or query.strip() == "":
             query = "Provide a comprehensive analysis of my blood test report"
             
         # Process the blood report
-        response = run_crew(
-            query=query.strip(), 
+        response = await run_crew(
+            query=query.strip(),
             file_path=file_path,
-            analysis_type=analysis_type
+            analysis_type=analysis_type,
+            mode=mode
         )
         
         return {
@@ -103,16 +348,132 @@ async def analyze_blood_report(
             "disclaimer": "This analysis is for educational purposes only and should not replace professional medical advice. Please consult with your healthcare provider for medical decisions."
         }
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error processing blood report: {str(e)}")
-    
+
     finally:
-        # Clean up uploaded file
-        if os.path.exists(file_path):
-            try:
-                os.remove(file_path)
-            except:
-                pass  # Ignore cleanup errors
+        # Drop the report from the in-memory store
+        unregister_report(file_path)
+
+@app.post("/analyze_many")
+async def analyze_blood_reports_bulk(
+    files: List[UploadFile] = File(...),
+    queries: str = Form(default="[]")
+):
+    """Analyze several blood test reports concurrently in one request
+
+    Accepts one query per file as a JSON array; missing entries fall back
+    to the default comprehensive query. Reports are processed via
+    kickoff_for_each_async so uploads share the event loop instead of
+    queueing behind each other.
+    """
+    for file in files:
+        if not file.filename.lower().endswith('.pdf'):
+            raise HTTPException(status_code=400, detail=f"Only PDF files are supported: {file.filename}")
+
+    try:
+        query_list = json.loads(queries)
+        if not isinstance(query_list, list) or not all(isinstance(q, str) for q in query_list):
+            raise ValueError
+    except (json.JSONDecodeError, ValueError):
+        raise HTTPException(status_code=400, detail="queries must be a JSON array of strings")
+
+    default_query = "Provide a comprehensive analysis of my blood test report"
+    file_paths = []
+
+    try:
+        inputs = []
+        for i, file in enumerate(files):
+            file_path = f"report://{uuid.uuid4()}"
+            file_paths.append(file_path)
+            await load_blood_report(file, file_path)
+            query = query_list[i].strip() if i < len(query_list) and query_list[i].strip() else default_query
+            inputs.append({'query': query, 'file_path': file_path})
+
+        results = await BULK_CREW.kickoff_for_each_async(inputs=inputs)
+
+        return {
+            "status": "success",
+            "results": [
+                {
+                    "file_processed": file.filename,
+                    "query": inp['query'],
+                    "analysis": str(result)
+                }
+                for file, inp, result in zip(files, inputs, results)
+            ],
+            "disclaimer": "This analysis is for educational purposes only and should not replace professional medical advice. Please consult with your healthcare provider for medical decisions."
+        }
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error processing blood reports: {str(e)}")
+
+    finally:
+        for file_path in file_paths:
+            unregister_report(file_path)
+
+
+@app.post("/analyze_batch")
+async def analyze_blood_report_batch(
+    file: UploadFile = File(...),
+    queries: str = Form(...)
+):
+    """Submit multiple queries against one report via the Gemini batch API
+
+    Batch mode costs 50% of interactive pricing; results are available via
+    GET /analyze_batch/{job_id} once the job completes (within 24h).
+    """
+    if not file.filename.lower().endswith('.pdf'):
+        raise HTTPException(status_code=400, detail="Only PDF files are supported")
+
+    # Accept either a JSON array of queries or one query per line
+    try:
+        query_list = json.loads(queries)
+        if not isinstance(query_list, list):
+            raise ValueError
+    except (json.JSONDecodeError, ValueError):
+        query_list = [q.strip() for q in queries.splitlines() if q.strip()]
+
+    if not query_list:
+        raise HTTPException(status_code=400, detail="At least one query is required")
+
+    try:
+        # Extract the report text once; the batch requests carry plain text.
+        # The genai client is synchronous (file upload + job create are
+        # blocking network calls), so run it off the event loop
+        report_text = await load_blood_report(file)
+        job_id = await asyncio.to_thread(batch.submit_batch_job, report_text, query_list)
+
+        return {
+            "status": "submitted",
+            "job_id": job_id,
+            "num_queries": len(query_list),
+            "file_processed": file.filename
+        }
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error submitting batch job: {str(e)}")
+
+
+@app.get("/analyze_batch/{job_id}")
+async def get_batch_results(job_id: str):
+    """Fetch the state and, once finished, the results of a batch job"""
+    try:
+        # Polling and result download are blocking genai calls as well
+        status = await asyncio.to_thread(batch.get_batch_job, job_id)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error fetching batch job: {str(e)}")
+
+    if status is None:
+        raise HTTPException(status_code=404, detail="Unknown batch job id")
+    return status
+
 
 @app.get("/health")
 async def health_check():
@@ -121,9 +482,20 @@ async def health_check():
         "status": "healthy",
         "service": "Blood Test Analyzer",
         "agents_available": ["doctor", "nutritionist", "exercise_specialist", "verifier"],
-        "analysis_types": ["comprehensive", "medical_only"]
+        "analysis_types": ["comprehensive", "medical_only"],
+        "llm_cache": llm.stats
     }
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
+    # uvloop + httptools handle several times more req/sec than the default
+    # asyncio loop and h11 parser; one worker per core gives each process
+    # its own event loop and sidesteps the GIL for PDF parsing
+    uvicorn.run(
+        "main:app",
+        host="0.0.0.0",
+        port=8000,
+        loop="uvloop",
+        http="httptools",
+        workers=os.cpu_count()
+    )
@@ -2,14 +2,15 @@
 # FIXED tools.py
 # ============================================================================
 
+import io
+import json
 import os
-from dotenv import load_dotenv
+import re
+from functools import lru_cache
 from typing import Type
 from crewai.tools import BaseTool
 from pydantic import BaseModel, Field
 
-load_dotenv()
-
 from crewai_tools import SerperDevTool
 
 # Creating search tool
@@ -21,6 +22,242 @@ try:
 except ImportError:
     from langchain.document_loaders import PyPDFLoader as PDFLoader
 
+from pypdf import PdfReader
+
+# Collapse runs of blank lines in one linear pass instead of a replace loop
+_DOUBLE_NL = re.compile(r"\n{2,}")
+
+
+@lru_cache(maxsize=32)
+def _load_report(path: str, mtime: float) -> str:
+    """Load and normalize a PDF once per (path, mtime)
+
+    The same report is read by up to four agents per request, so extraction
+    is memoized; mtime in the key invalidates stale entries if a path is
+    reused for a different file.
+    """
+    loader = PDFLoader(file_path=path)
+    docs = loader.load()
+
+    full_report = ""
+    for data in docs:
+        content = _DOUBLE_NL.sub("\n", data.page_content)
+        full_report += content + "\n"
+
+    return full_report if full_report.strip() else "No content found in PDF"
+
+
+# In-memory store of extracted report text keyed by a synthetic path
+# (report://<id>), so uploads never have to touch disk. The API layer
+# registers an upload before kicking off the crew and removes it when
+# the request finishes.
+_REPORT_STORE = {}
+
+
+def extract_pdf_text(pdf_bytes: bytes) -> str:
+    """Extract and normalize text from in-memory PDF bytes"""
+    reader = PdfReader(io.BytesIO(pdf_bytes))
+
+    full_report = ""
+    for page in reader.pages:
+        content = _DOUBLE_NL.sub("\n", page.extract_text() or "")
+        full_report += content + "\n"
+
+    return full_report if full_report.strip() else "No content found in PDF"
+
+
+def register_report(path: str, pdf_bytes: bytes) -> str:
+    """Parse uploaded PDF bytes once and serve them under a synthetic path"""
+    text = extract_pdf_text(pdf_bytes)
+    _REPORT_STORE[path] = text
+    return text
+
+
+def register_report_text(path: str, report_text: str):
+    """Register already-extracted report text (used by process-pool workers)"""
+    _REPORT_STORE[path] = report_text
+
+
+def get_report_text(path: str):
+    """Return the registered report text for a synthetic path, if any"""
+    return _REPORT_STORE.get(path)
+
+
+def unregister_report(path: str):
+    """Drop a registered report once its request is finished"""
+    _REPORT_STORE.pop(path, None)
+
+
+# Deterministic pre-pass distilling the report into structured findings.
+# One regex run replaces four agents each reasoning over the raw PDF text:
+# when enough markers parse, the blood_test_reader returns this compact
+# JSON instead, shrinking downstream prompts by an order of magnitude.
+_FINDING_MARKERS = (
+    "hemoglobin", "hgb", "hba1c", "wbc", "rbc", "platelets", "ldl", "hdl",
+    "triglycerides", "cholesterol", "glucose", "tsh", "vitamin d",
+    "vitamin b12", "creatinine", "urea", "ferritin", "iron", "calcium",
+    "sodium", "potassium"
+)
+# Bare marker mentions (no value required) used by the deterministic
+# document gate in the API layer and to anchor the row parser below.
+# Letter lookarounds instead of \b: real PDFs glue values to names
+# ("105.00Cholesterol") and \b does not match a digit-letter seam.
+_MARKER_TOKEN_PATTERN = re.compile(
+    r"(?<![A-Za-z])(?:" + "|".join(re.escape(m) for m in _FINDING_MARKERS) + r")(?![A-Za-z])",
+    re.IGNORECASE
+)
+
+# Real lab PDFs extract in several row shapes, often with values glued to
+# the surrounding text: "105.00Cholesterol, Total ... <200.00 mg/dL"
+# (value before the name), "Hemoglobin ... 13.00 - 17.00 g/dL15.00"
+# (range and unit before the value), "HbA1c 5.3 % 4.00 - 5.60" and
+# "280.00 pg/mL 211.00 - 911.00" (value before the range). The parser
+# anchors on the marker name, finds the reference range nearby, and
+# resolves the value relative to it.
+_NUMBER = r"\d+(?:\.\d+)?"
+# A number not embedded in a word or hyphenated token, so assay names
+# like "VITAMIN D, 25-HYDROXY" never contribute a value
+_STANDALONE_NUMBER = re.compile(r"(?<![\w.-])(" + _NUMBER + r")(?![\w-])")
+# Two-sided "low - high" or one-sided "<high" / ">low" reference range
+_RANGE_PATTERN = re.compile(
+    r"(" + _NUMBER + r")\s*[-–]\s*(" + _NUMBER + r")|([<>])\s*(" + _NUMBER + r")"
+)
+# Strictly adjacent (\Z, since $ would match before a trailing newline):
+# a value separated from the name by whitespace belongs to the previous
+# row, not this one
+_GLUED_VALUE_BEFORE = re.compile(r"(" + _NUMBER + r")\Z")
+_UNIT_PATTERN = re.compile(r"\s*([A-Za-zµ%][\w/%.µ]*)")
+_TRAILING_GLUED_VALUE = re.compile(r"(\d+\.\d+)$")
+
+# How far past the marker name to look for its range and value; wide
+# enough to span an interleaved "(Method)" line
+_FINDING_WINDOW = 90
+
+# At least this many distinct markers must parse (value plus reference
+# range) before the distilled JSON replaces the raw report text; set high
+# so a handful of accidental matches can never displace the report
+MIN_FINDINGS_FOR_DISTILLATION = 6
+
+
+def _parse_finding(report_text: str, marker_match) -> dict:
+    """Parse the row around one marker mention, or None if it is not a row
+
+    Requiring both a reference range and a resolvable value filters out
+    narrative mentions of a marker (summary notes, advice paragraphs)
+    without any per-layout special casing.
+    """
+    window = report_text[marker_match.end():marker_match.end() + _FINDING_WINDOW]
+    range_match = _RANGE_PATTERN.search(window)
+    if range_match is None:
+        return None
+
+    if range_match.group(1) is not None:
+        low, high = float(range_match.group(1)), float(range_match.group(2))
+        ref_range = f"{range_match.group(1)}-{range_match.group(2)}"
+    else:
+        bound = float(range_match.group(4))
+        low, high = (bound, None) if range_match.group(3) == ">" else (None, bound)
+        ref_range = range_match.group(3) + range_match.group(4)
+
+    value = None
+    unit = None
+
+    # Value glued directly before the name: "105.00Cholesterol, Total"
+    before = _GLUED_VALUE_BEFORE.search(
+        report_text[max(0, marker_match.start() - 12):marker_match.start()]
+    )
+    if before is not None:
+        value = float(before.group(1))
+        tail = _UNIT_PATTERN.match(window, range_match.end())
+        if tail:
+            unit = _TRAILING_GLUED_VALUE.sub("", tail.group(1)) or None
+        return _flag_finding(value, unit, ref_range, low, high)
+
+    # Value between the name and the range: "HbA1c 5.3 % 4.00 - 5.60".
+    # The last number before the range wins; numbers further from the
+    # range belong to the assay name ("VITAMIN D, 25 - HYDROXY"), not
+    # the result
+    number = None
+    for number in _STANDALONE_NUMBER.finditer(window, 0, range_match.start()):
+        pass
+    if number is not None:
+        value = float(number.group(1))
+        tail = _UNIT_PATTERN.match(window, number.end())
+        if tail:
+            unit = _TRAILING_GLUED_VALUE.sub("", tail.group(1)) or None
+        return _flag_finding(value, unit, ref_range, low, high)
+
+    # Value glued after the unit past the range: "13.00 - 17.00 g/dL15.00".
+    # The unit/value split can be ambiguous when the unit itself ends in a
+    # digit ("mill/mm34.50" is mill/mm3 + 4.50), so among the possible
+    # splits prefer the one whose value falls inside the reference range
+    tail = _UNIT_PATTERN.match(window, range_match.end())
+    if tail:
+        candidates = []
+        pos = 0
+        while (glued := _TRAILING_GLUED_VALUE.search(tail.group(1), pos)) is not None:
+            candidates.append(glued)
+            pos = glued.start() + 1
+        if candidates:
+            chosen = candidates[0]
+            for candidate in candidates:
+                v = float(candidate.group(1))
+                if (low is None or v >= low) and (high is None or v <= high):
+                    chosen = candidate
+                    break
+            value = float(chosen.group(1))
+            unit = tail.group(1)[:chosen.start()] or None
+            return _flag_finding(value, unit, ref_range, low, high)
+    return None
+
+
+def _flag_finding(value, unit, ref_range, low, high) -> dict:
+    if low is not None and value < low:
+        flag = "low"
+    elif high is not None and value > high:
+        flag = "high"
+    else:
+        flag = "normal"
+    return {"value": value, "unit": unit, "ref_range": ref_range, "flag": flag}
+
+
+def extract_findings(report_text: str) -> dict:
+    """Extract {marker: {value, unit, ref_range, flag}} from report text
+
+    The flag is computed against the reference range on the same row, so
+    downstream consumers see low/high/normal without re-deriving it. The
+    first mention of a marker that parses as a full result row wins;
+    mentions without a range and value alongside are skipped.
+    """
+    findings = {}
+    for match in _MARKER_TOKEN_PATTERN.finditer(report_text):
+        marker = match.group(0).casefold()
+        if marker in findings:
+            continue
+        finding = _parse_finding(report_text, match)
+        if finding is not None:
+            findings[marker] = finding
+    return findings
+
+
+def looks_like_blood_report(report_text: str) -> bool:
+    """Cheap deterministic check that a document is a blood test report
+
+    Requires at least three distinct blood markers to be mentioned, which
+    rejects arbitrary PDFs without spending an LLM call.
+    """
+    found = {m.group(0).casefold() for m in _MARKER_TOKEN_PATTERN.finditer(report_text)}
+    return len(found) >= 3
+
+
+def distill_report(report_text: str) -> str:
+    """Return compact findings JSON when the report parses, else the raw text"""
+    findings = extract_findings(report_text)
+    if len(findings) >= MIN_FINDINGS_FOR_DISTILLATION:
+        return json.dumps({"structured_findings": findings}, indent=2)
+    return report_text
+
+
 # Fix 2: Create proper tool input schema
 class BloodTestReportInput(BaseModel):
     """Input for BloodTestReportTool."""
@@ -31,6 +268,9 @@ class BloodTestReportTool(BaseTool):
     name: str = "blood_test_reader"
     description: str = "Reads and extracts data from blood test PDF reports"
     args_schema: Type[BaseModel] = BloodTestReportInput
+    # Distillation is for the analysis agents only; the verifier judges
+    # document legitimacy and must see the raw extracted text
+    distill: bool = True
 
     def _run(self, path: str = "data/sample.pdf") -> str:
         """Tool to read data from a pdf file from a path
@@ -42,32 +282,40 @@ class BloodTestReportTool(BaseTool):
             str: Full Blood Test report file content
         """
         try:
-            # Check if file exists
-            if not os.path.exists(path):
+            # In-memory reports registered by the API layer take priority
+            if path in _REPORT_STORE:
+                text = _REPORT_STORE[path]
+            elif not os.path.exists(path):
                 return f"Error: File not found at path: {path}"
-            
-            # Load PDF using the proper loader
-            loader = PDFLoader(file_path=path)
-            docs = loader.load()
-
-            full_report = ""
-            for data in docs:
-                # Clean and format the report data
-                content = data.page_content
-                
-                # Remove extra whitespaces and format properly
-                while "\n\n" in content:
-                    content = content.replace("\n\n", "\n")
-                    
-                full_report += content + "\n"
-                
-            return full_report if full_report.strip() else "No content found in PDF"
-            
+            else:
+                # Serve repeat reads of the same file from the extraction cache
+                text = _load_report(path, os.path.getmtime(path))
+
+            return distill_report(text) if self.distill else text
+
         except Exception as e:
             return f"Error reading PDF file: {str(e)}"
 
-# Create tool instance
+# Create tool instances; the raw variant backs the verifier
 blood_test_tool = BloodTestReportTool()
+raw_blood_test_tool = BloodTestReportTool(distill=False)
+
+# Marker/modifier vocabulary for the single-pass scan shared by the
+# nutrition and exercise tools. One compiled alternation replaces the
+# ~10 independent substring passes each tool made over the report text.
+# "below" is omitted because "low" already matches inside it.
+_SCAN_TOKENS = (
+    "vitamin d", "vit d", "blood sugar", "hemoglobin", "hgb", "hb",
+    "cholesterol", "glucose", "low", "deficient", "insufficient",
+    "high", "elevated", "anemia", "diabetes"
+)
+_SCAN_PATTERN = re.compile("|".join(re.escape(token) for token in _SCAN_TOKENS))
+
+
+def extract_marker_hits(blood_report_data: str) -> set:
+    """Scan the report once and return the set of marker/modifier tokens found"""
+    return set(_SCAN_PATTERN.findall(blood_report_data.casefold()))
+
 
 # Fix 4: Implement proper nutrition and exercise tools
 class NutritionAnalysisInput(BaseModel):
@@ -82,29 +330,24 @@ class NutritionTool(BaseTool):
     def _run(self, blood_report_data: str) -> str:
         """Analyze blood report and provide nutrition recommendations"""
         try:
-            # Basic nutrition analysis based on common blood markers
+            # Basic nutrition analysis based on common blood markers,
+            # checked against a single scan over the report text
             recommendations = []
-            
-            # Convert to lowercase for easier matching
-            data_lower = blood_report_data.lower()
-            
+            hits = extract_marker_hits(blood_report_data)
+
             # Check for common deficiencies and imbalances
-            if any(term in data_lower for term in ['hemoglobin', 'hgb', 'hb']):
-                if any(term in data_lower for term in ['low', 'below', 'deficient']):
-                    recommendations.append("Consider iron-rich foods: spinach, red meat, lentils, fortified cereals")
-            
-            if 'vitamin d' in data_lower or 'vit d' in data_lower:
-                if any(term in data_lower for term in ['low', 'deficient', 'insufficient']):
-                    recommendations.append("Increase vitamin D: fatty fish, fortified milk, sunlight exposure")
-            
-            if 'cholesterol' in data_lower:
-                if any(term in data_lower for term in ['high', 'elevated']):
-                    recommendations.append("Heart-healthy diet: reduce saturated fats, increase fiber, omega-3 fatty acids")
-            
-            if 'glucose' in data_lower or 'blood sugar' in data_lower:
-                if any(term in data_lower for term in ['high', 'elevated']):
-                    recommendations.append("Blood sugar management: complex carbohydrates, regular meals, limit refined sugars")
-            
+            if hits & {'hemoglobin', 'hgb', 'hb'} and hits & {'low', 'deficient'}:
+                recommendations.append("Consider iron-rich foods: spinach, red meat, lentils, fortified cereals")
+
+            if hits & {'vitamin d', 'vit d'} and hits & {'low', 'deficient', 'insufficient'}:
+                recommendations.append("Increase vitamin D: fatty fish, fortified milk, sunlight exposure")
+
+            if 'cholesterol' in hits and hits & {'high', 'elevated'}:
+                recommendations.append("Heart-healthy diet: reduce saturated fats, increase fiber, omega-3 fatty acids")
+
+            if hits & {'glucose', 'blood sugar'} and hits & {'high', 'elevated'}:
+                recommendations.append("Blood sugar management: complex carbohydrates, regular meals, limit refined sugars")
+
             if not recommendations:
                 recommendations.append("Maintain a balanced diet with variety of fruits, vegetables, lean proteins, and whole grains")
             
@@ -126,18 +369,18 @@ class ExerciseTool(BaseTool):
         """Create exercise plan based on blood analysis"""
         try:
             recommendations = []
-            data_lower = blood_report_data.lower()
-            
+            hits = extract_marker_hits(blood_report_data)
+
             # Check for conditions that affect exercise
-            if any(term in data_lower for term in ['hemoglobin', 'hgb']) and any(term in data_lower for term in ['low', 'anemia']):
+            if hits & {'hemoglobin', 'hgb'} and hits & {'low', 'anemia'}:
                 recommendations.append("Start with light exercise: walking, gentle yoga. Gradually increase intensity as iron levels improve")
-            
-            if 'cholesterol' in data_lower and any(term in data_lower for term in ['high', 'elevated']):
+
+            if 'cholesterol' in hits and hits & {'high', 'elevated'}:
                 recommendations.append("Cardiovascular exercise: 30 minutes moderate activity 5 days/week (walking, swimming, cycling)")
-            
-            if 'glucose' in data_lower and any(term in data_lower for term in ['high', 'diabetes']):
+
+            if 'glucose' in hits and hits & {'high', 'diabetes'}:
                 recommendations.append("Blood sugar management: regular exercise, resistance training 2-3x/week, post-meal walks")
-            
+
             # General recommendations
             recommendations.extend([
                 "Strength training: 2-3 sessions per week targeting major muscle groups",